@@ -3,8 +3,12 @@ from tkinter import ttk, messagebox, scrolledtext
 import vlc
 import json
 import os
+import re
+import sqlite3
+import sys
 import logging
 import time
+from collections import OrderedDict
 from datetime import datetime
 import threading
 
@@ -13,128 +17,646 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 
 VIDEO_DIR = r"F:/Study/research/desire-qa/videos/"
 JSON_FILE = r"F:/Study/research/desire-qa/desire-qa/desire_oriented_vqa.json"
+SESSION_DIR = r"F:/Study/research/desire-qa/session/"
+ANNOTATION_CACHE_BYTES = 4 * 1024 * 1024  # 标注缓存的内存预算（字节，按解析后的对象大小估算）
 
 
-def load_annotations_from_json(video_id):
-    """从JSON文件加载标注数据"""
-    try:
-        with open(JSON_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        # 1. 首先直接匹配key
-        if video_id in data:
-            logging.info(f"直接匹配到视频ID: {video_id}")
-            return data[video_id]
-
-        # 2. 通过metadata中的video_id匹配
-        for key, value in data.items():
-            if "metadata" in value and "video_id" in value["metadata"]:
-                metadata_video_id = value["metadata"]["video_id"]
-                if metadata_video_id == video_id:
-                    logging.info(f"通过metadata匹配到视频ID: {video_id}")
-                    return value
-
-        # 3. 通过metadata中的youtube_id + 时间匹配
-        for key, value in data.items():
-            if "metadata" in value:
-                metadata = value["metadata"]
-                if all(k in metadata for k in ["youtube_id", "start_seconds", "end_seconds"]):
-                    youtube_id = metadata["youtube_id"]
-                    start_sec = metadata["start_seconds"]
-                    end_sec = metadata["end_seconds"]
-                    full_id = f"{youtube_id}_{start_sec}_{end_sec}"
-
-                    if full_id == video_id:
-                        logging.info(f"通过metadata构造ID匹配到视频: {video_id}")
-                        return value
-
-                    # 也匹配只有youtube_id的情况
-                    if youtube_id == video_id:
-                        logging.info(f"通过youtube_id匹配到视频: {video_id}")
-                        return value
-
-        # 4. 兼容旧格式
-        for key, value in data.items():
-            if "desire_analysis" in value:
-                desire_analysis = value["desire_analysis"]
-                if all(k in desire_analysis for k in ["YouTube_ID", "Start_Seconds", "End_Seconds"]):
-                    youtube_id = desire_analysis["YouTube_ID"]
-                    start_sec = desire_analysis["Start_Seconds"]
-                    end_sec = desire_analysis["End_Seconds"]
-                    full_id = f"{youtube_id}_{start_sec}_{end_sec}"
-
-                    if full_id == video_id or youtube_id == video_id:
-                        logging.info(f"通过旧格式匹配到视频: {video_id}")
-                        return value
-
-        # 5. 模糊匹配：如果输入的video_id包含下划线，尝试匹配基本ID
-        if '_' in video_id:
-            base_video_id = video_id.split('_')[0]
-            for key, value in data.items():
-                if key == base_video_id:
-                    logging.info(f"通过基本ID匹配到视频: {base_video_id}")
-                    return value
-
-                # 检查metadata中的youtube_id
-                if "metadata" in value and "youtube_id" in value["metadata"]:
-                    if value["metadata"]["youtube_id"] == base_video_id:
-                        logging.info(f"通过metadata基本ID匹配到视频: {base_video_id}")
-                        return value
-
-        logging.warning(f"未在JSON中找到视频ID: {video_id}")
-        return {}
+class AnnotationIndex:
+    """标注文件的磁盘索引：用SQLite保存每条标注在JSON中的字节位置，以及各种视频ID到记录key的映射
 
-    except Exception as e:
-        logging.error(f"加载JSON文件时出错: {str(e)}")
-        return {}
+    偏移表和ID映射都留在磁盘上按需查询，标注内容也只在需要时按偏移读取，
+    内存占用不随数据集大小增长。
+    """
 
+    INDEX_SUFFIX = ".idx"
+    CHUNK_SIZE = 1024 * 1024
+    TOKEN_PATTERN = re.compile(rb'[\\"{}\[\],:]')
+    SQLITE_CACHE_KB = 1024  # SQLite页缓存上限
 
-def get_annotated_video_ids():
-    """获取所有已标注的视频ID"""
-    ids = []
-    try:
-        with open(JSON_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        for key, value in data.items():
-            # 1. 添加JSON中的key作为ID
-            ids.append(key)
-
-            # 2. 如果有metadata，也添加相关ID
-            if "metadata" in value:
-                metadata = value["metadata"]
-
-                # 添加metadata中的video_id
-                if "video_id" in metadata:
-                    ids.append(metadata["video_id"])
-
-                # 添加通过metadata构造的完整ID
-                if all(k in metadata for k in ["youtube_id", "start_seconds", "end_seconds"]):
-                    youtube_id = metadata["youtube_id"]
-                    start_sec = metadata["start_seconds"]
-                    end_sec = metadata["end_seconds"]
-                    full_id = f"{youtube_id}_{start_sec}_{end_sec}"
-                    ids.append(full_id)
-
-                    # 也添加youtube_id
-                    ids.append(youtube_id)
-
-            # 3. 兼容旧格式
-            if "desire_analysis" in value:
-                desire_analysis = value["desire_analysis"]
-                if all(k in desire_analysis for k in ["YouTube_ID", "Start_Seconds", "End_Seconds"]):
-                    youtube_id = desire_analysis["YouTube_ID"]
-                    start_sec = desire_analysis["Start_Seconds"]
-                    end_sec = desire_analysis["End_Seconds"]
-                    full_id = f"{youtube_id}_{start_sec}_{end_sec}"
-                    ids.append(full_id)
-                    ids.append(youtube_id)
+    # ID映射的层级，数字越小优先级越高；同一层内先出现的记录优先
+    TIER_KEY = 0          # 记录key
+    TIER_VIDEO_ID = 1     # metadata.video_id
+    TIER_METADATA_ID = 2  # metadata中的youtube_id_开始_结束，以及youtube_id
+    TIER_LEGACY_ID = 3    # 旧格式desire_analysis中的YouTube_ID_开始_结束，以及YouTube_ID
+    TIER_BASE_ID = 4      # 记录key，以及metadata.youtube_id（用于带下划线ID的模糊匹配）
 
-    except Exception as e:
-        logging.error(f"解析JSON时出错: {str(e)}")
+    SCHEMA = """
+        CREATE TABLE source (size INTEGER, mtime_ns INTEGER);
+        CREATE TABLE records (key TEXT PRIMARY KEY, offset INTEGER, length INTEGER);
+        CREATE TABLE aliases (alias TEXT, tier INTEGER, key TEXT, PRIMARY KEY (alias, tier));
+    """
+
+    def __init__(self, json_file):
+        self.json_file = json_file
+        self.index_file = json_file + self.INDEX_SUFFIX
+        self.source = None
+        self._db = None
+
+        try:
+            if not self._load():
+                self._build()
+        except Exception as e:
+            logging.error(f"建立标注索引时出错: {str(e)}")
+
+    def _source_signature(self):
+        stat = os.stat(self.json_file)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _connect(self, path):
+        db = sqlite3.connect(path)
+        db.execute(f"PRAGMA cache_size = -{self.SQLITE_CACHE_KB}")
+        return db
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _load(self):
+        """打开已有的索引，源文件变化或索引损坏时返回False"""
+        if not os.path.exists(self.index_file):
+            return False
+
+        db = None
+        try:
+            db = self._connect(self.index_file)
+            row = db.execute("SELECT size, mtime_ns FROM source").fetchone()
+            count = db.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+            db.execute("SELECT alias, tier, key FROM aliases LIMIT 1").fetchall()
+            source = self._source_signature()
+        except (sqlite3.Error, OSError):
+            logging.warning("标注索引文件格式不正确，重建索引")
+            if db is not None:
+                db.close()
+            return False
+
+        if row is None or list(row) != source:
+            logging.info("标注文件已变化，重建索引")
+            db.close()
+            return False
+
+        self._db = db
+        self.source = source
+        logging.info(f"已加载标注索引: {count} 条记录")
+        return True
+
+    def _scan(self):
+        """分块扫描JSON顶层对象，逐条产出记录的(key起点, key终点, 值起点, 值终点)"""
+        depth = 0
+        in_string = False
+        string_is_key = False
+        escape_at = -1
+        expecting_key = False
+        key_start = key_end = value_start = None
+        base = 0
+
+        with open(self.json_file, 'rb') as f:
+            while True:
+                chunk = f.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                for m in self.TOKEN_PATTERN.finditer(chunk):
+                    pos = base + m.start()
+                    c = m.group()
+
+                    if in_string:
+                        if pos == escape_at:
+                            continue
+                        if c == b'\\':
+                            escape_at = pos + 1
+                        elif c == b'"':
+                            in_string = False
+                            if string_is_key:
+                                key_end = pos + 1
+                        continue
+
+                    if c == b'"':
+                        in_string = True
+                        string_is_key = depth == 1 and expecting_key
+                        if string_is_key:
+                            key_start = pos
+                    elif c in (b'{', b'['):
+                        depth += 1
+                        if depth == 1:
+                            expecting_key = True
+                    elif c in (b'}', b']'):
+                        if depth == 1 and value_start is not None:
+                            yield key_start, key_end, value_start, pos
+                            value_start = None
+                        depth -= 1
+                    elif depth == 1 and c == b':':
+                        value_start = pos + 1
+                        expecting_key = False
+                    elif depth == 1 and c == b',':
+                        yield key_start, key_end, value_start, pos
+                        value_start = None
+                        expecting_key = True
+
+                base += len(chunk)
+
+    def _build(self):
+        """扫描标注文件重建索引；无法写入磁盘时退回到内存中的索引"""
+        self._close()
+        self.source = None
+        source = self._source_signature()
+        tmp_path = self.index_file + ".tmp"
+
+        db = None
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            db = self._connect(tmp_path)
+            self._fill(db, source)
+            db.close()
+            db = None
+            os.replace(tmp_path, self.index_file)
+            self._db = self._connect(self.index_file)
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"无法保存标注索引，改为在内存中建立: {str(e)}")
+            if db is not None:
+                db.close()
+            self._db = self._connect(":memory:")
+            self._fill(self._db, source)
+
+        # 即使标注文件只解析了一部分也记录签名，避免每次查询都重新扫描同一个文件
+        self.source = source
+
+    def _fill(self, db, source):
+        """逐条解析记录写入索引，每次只在内存中保留一条记录"""
+        db.executescript(self.SCHEMA)
+        count = 0
+        try:
+            with open(self.json_file, 'rb') as f:
+                for key_start, key_end, value_start, value_end in self._scan():
+                    f.seek(key_start)
+                    key = json.loads(f.read(key_end - key_start))
+                    f.seek(value_start)
+                    value = json.loads(f.read(value_end - value_start))
+
+                    if not isinstance(value, dict):
+                        logging.warning(f"标注记录 {key} 不是对象，已跳过")
+                        continue
+
+                    db.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?)",
+                               (key, value_start, value_end - value_start))
+                    db.executemany("INSERT OR IGNORE INTO aliases VALUES (?, ?, ?)",
+                                   self._aliases(key, value))
+                    count += 1
+        except Exception as e:
+            logging.error(f"解析标注文件时出错，索引只包含前 {count} 条记录: {str(e)}")
+
+        db.execute("INSERT INTO source VALUES (?, ?)", source)
+        db.commit()
+        logging.info(f"已建立标注索引: {count} 条记录")
+
+    def _aliases(self, key, value):
+        """产出一条记录的(ID, 层级, key)，只收录字符串ID"""
+        metadata = value.get("metadata")
+        if not isinstance(metadata, dict):
+            metadata = {}
+        desire_analysis = value.get("desire_analysis")
+        if not isinstance(desire_analysis, dict):
+            desire_analysis = {}
+
+        aliases = [(key, self.TIER_KEY)]
+
+        if "video_id" in metadata:
+            aliases.append((metadata["video_id"], self.TIER_VIDEO_ID))
+
+        if all(k in metadata for k in ["youtube_id", "start_seconds", "end_seconds"]):
+            youtube_id = metadata["youtube_id"]
+            full_id = f"{youtube_id}_{metadata['start_seconds']}_{metadata['end_seconds']}"
+            aliases.append((full_id, self.TIER_METADATA_ID))
+            aliases.append((youtube_id, self.TIER_METADATA_ID))
+
+        if all(k in desire_analysis for k in ["YouTube_ID", "Start_Seconds", "End_Seconds"]):
+            youtube_id = desire_analysis["YouTube_ID"]
+            full_id = f"{youtube_id}_{desire_analysis['Start_Seconds']}_{desire_analysis['End_Seconds']}"
+            aliases.append((full_id, self.TIER_LEGACY_ID))
+            aliases.append((youtube_id, self.TIER_LEGACY_ID))
+
+        aliases.append((key, self.TIER_BASE_ID))
+        if "youtube_id" in metadata:
+            aliases.append((metadata["youtube_id"], self.TIER_BASE_ID))
+
+        return [(alias, tier, key) for alias, tier in aliases if isinstance(alias, str)]
+
+    def refresh(self):
+        """标注文件在运行期间被修改时重建索引，重建了返回True"""
+        try:
+            if self._source_signature() == self.source:
+                return False
+        except OSError as e:
+            logging.error(f"读取标注文件信息时出错: {str(e)}")
+            return False
+
+        logging.info("标注文件已变化，重建索引")
+        try:
+            self._build()
+        except Exception as e:
+            logging.error(f"重建标注索引时出错: {str(e)}")
+        return True
+
+    def _lookup(self, video_id, max_tier):
+        row = self._db.execute(
+            "SELECT key FROM aliases WHERE alias = ? AND tier <= ? ORDER BY tier LIMIT 1",
+            (video_id, max_tier)).fetchone()
+        return row[0] if row else None
+
+    def resolve(self, video_id):
+        """把视频ID解析为JSON中的记录key，找不到时返回None
+
+        匹配顺序：记录key > metadata.video_id > metadata构造ID/youtube_id
+        > 旧格式构造ID/YouTube_ID > 带下划线ID的基本ID（记录key或metadata.youtube_id）
+        """
+        if self._db is None:
+            return None
+
+        key = self._lookup(video_id, self.TIER_LEGACY_ID)
+        if key is None and '_' in video_id:
+            row = self._db.execute(
+                "SELECT key FROM aliases WHERE alias = ? AND tier = ?",
+                (video_id.split('_')[0], self.TIER_BASE_ID)).fetchone()
+            key = row[0] if row else None
+        return key
+
+    def contains(self, video_id):
+        """视频ID是否是已标注的ID（不含基本ID模糊匹配）"""
+        return self._db is not None and self._lookup(video_id, self.TIER_LEGACY_ID) is not None
+
+    def has_prefix_match(self, video_id):
+        """是否有已标注的ID以video_id开头，或是video_id的前缀"""
+        if self._db is None or not video_id:
+            return False
+
+        # 以video_id开头：在(alias, tier)主键上做范围查询
+        row = self._db.execute(
+            "SELECT 1 FROM aliases WHERE alias >= ? AND alias < ? AND tier <= ? LIMIT 1",
+            (video_id, video_id + '\U0010ffff', self.TIER_LEGACY_ID)).fetchone()
+        if row:
+            return True
+
+        # 是video_id的前缀：逐个查询video_id的前缀
+        return any(self.contains(video_id[:i]) for i in range(1, len(video_id)))
+
+    def read_record(self, key):
+        """按偏移表从磁盘读取一条记录"""
+        row = self._db.execute("SELECT offset, length FROM records WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        offset, length = row
+        with open(self.json_file, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+
+
+class AnnotationCache:
+    """按内存预算的LRU标注缓存，位于AnnotationIndex与界面之间"""
+
+    def __init__(self, index, budget_bytes):
+        self.index = index
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._records = OrderedDict()  # key -> (记录, 字节数)，按最近使用排序
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def clear(self):
+        self._records.clear()
+        self.used_bytes = 0
+
+    @staticmethod
+    def _memory_size(obj):
+        """递归估算解析后的记录占用的内存字节数"""
+        size = sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            size += sum(AnnotationCache._memory_size(k) + AnnotationCache._memory_size(v)
+                        for k, v in obj.items())
+        elif isinstance(obj, list):
+            size += sum(AnnotationCache._memory_size(item) for item in obj)
+        return size
+
+    def get(self, video_id):
+        """获取视频对应的标注，找不到时返回空字典"""
+        # 标注文件被修改过时，旧的偏移和缓存内容都已失效
+        if self.index.refresh():
+            self.clear()
+
+        key = self.index.resolve(video_id)
+        if key is None:
+            logging.warning(f"未在JSON中找到视频ID: {video_id}")
+            return {}
+
+        if key in self._records:
+            self.hits += 1
+            self._records.move_to_end(key)
+            return self._records[key][0]
+
+        self.misses += 1
+        try:
+            record = self.index.read_record(key)
+        except Exception as e:
+            logging.error(f"读取标注记录时出错: {str(e)}")
+            return {}
+
+        # 按解析后对象的估算内存计费；超过整个预算的记录不缓存
+        size = self._memory_size(record)
+        if size <= self.budget_bytes:
+            self._records[key] = (record, size)
+            self.used_bytes += size
+            while self.used_bytes > self.budget_bytes:
+                _, (_, evicted_size) = self._records.popitem(last=False)
+                self.used_bytes -= evicted_size
+
+        return record
+
+
+class ReviewSession:
+    """审阅进度会话：追加写日志 + 快照，崩溃或重启后可恢复进度"""
+
+    JOURNAL_NAME = "review.journal"
+    SNAPSHOT_NAME = "review.snapshot"
+    FSYNC_BATCH = 32            # 累积多少条记录后fsync一次
+    FSYNC_INTERVAL = 2.0        # 有未落盘记录时，距上次fsync的最长秒数
+    COMPACT_THRESHOLD = 4096    # 日志超过多少条记录时合并进快照
+    POSITION_STEP_MS = 1000     # 播放位置变化超过多少毫秒才记录
+
+    def __init__(self, session_dir, video_dir, json_file):
+        self.session_dir = session_dir
+        self.video_dir = video_dir
+        self.json_file = json_file
+        self.journal_path = os.path.join(session_dir, self.JOURNAL_NAME)
+        self.snapshot_path = os.path.join(session_dir, self.SNAPSHOT_NAME)
+
+        self.playlist = []
+        self.index = 0
+        self.clips = {}  # 片段ID -> [已看, 已标记]
+        self.clip = None
+        self.position_ms = 0
+
+        self._journal = None
+        self._journal_records = 0
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _source_signature(self):
+        """播放列表依赖的输入：视频目录（增删文件会改变目录的修改时间）和标注文件"""
+        video_stat = os.stat(self.video_dir)
+        json_stat = os.stat(self.json_file)
+        return [self.video_dir, video_stat.st_mtime_ns,
+                self.json_file, json_stat.st_size, json_stat.st_mtime_ns]
+
+    @staticmethod
+    def _is_int(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    def _read_snapshot(self):
+        """读取并校验快照，没有可用快照时返回None"""
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.error(f"读取会话快照时出错: {str(e)}")
+            return None
+
+        valid = (
+            isinstance(snapshot, dict)
+            and isinstance(snapshot.get("playlist"), list)
+            and all(isinstance(f, str) for f in snapshot["playlist"])
+            and self._is_int(snapshot.get("index")) and snapshot["index"] >= 0
+            and isinstance(snapshot.get("clips"), dict)
+            and all(isinstance(state, list) and len(state) == 2
+                    and all(isinstance(x, bool) for x in state)
+                    for state in snapshot["clips"].values())
+            and (snapshot.get("clip") is None or isinstance(snapshot["clip"], str))
+            and self._is_int(snapshot.get("position_ms"))
+        )
+        if not valid:
+            logging.error("会话快照格式不正确，忽略")
+            return None
+        return snapshot
+
+    def restore(self):
+        """从快照和日志恢复会话，播放列表仍然有效时返回True
+
+        视频目录或标注文件有变化、或没有可用快照时，仍会恢复日志中的已看/标记状态，
+        但返回False，由调用方重新扫描后调用start()
+        """
+        snapshot = self._read_snapshot()
+        if snapshot is not None:
+            self.playlist = snapshot["playlist"]
+            self.index = snapshot["index"]
+            self.clips = snapshot["clips"]
+            self.clip = snapshot["clip"]
+            self.position_ms = snapshot["position_ms"]
+
+        # 没有可用快照时也要重放日志，否则start()写快照时会把日志清空
+        self._journal_records = self._replay_journal()
+        self._open_journal()
+
+        if snapshot is None:
+            if self._journal_records:
+                logging.info(f"没有可用的会话快照，已从日志恢复 {self._journal_records} 条记录")
+            return False
+
+        logging.info(f"已恢复审阅会话: 共 {len(self.playlist)} 个视频，当前位置 {self.index}，"
+                     f"重放日志 {self._journal_records} 条")
+
+        try:
+            source = self._source_signature()
+        except OSError as e:
+            logging.error(f"读取视频目录或标注文件信息时出错: {str(e)}")
+            return False
+        if snapshot.get("source") != source:
+            logging.info("视频目录或标注文件已变化，需要重新扫描播放列表")
+            return False
+        return bool(self.playlist)
+
+    def start(self, playlist):
+        """以新的播放列表开始会话，保留已有的已看/标记状态和当前片段"""
+        playlist = list(playlist)
+
+        # 尽量让播放位置停在原来正在看的片段之后
+        index = 0
+        if 0 < self.index <= len(self.playlist) and self.playlist[self.index - 1] in playlist:
+            index = playlist.index(self.playlist[self.index - 1]) + 1
+
+        self.playlist = playlist
+        # 先把新位置写进日志：快照替换后、日志清空前崩溃时，重放旧日志仍会停在新位置
+        self._append({"op": "i", "v": index})
+        self.sync()
+        self.snapshot()
+
+    def _replay_journal(self):
+        """重放日志，截掉崩溃时写了一半的末尾记录"""
+        count = 0
+        good_offset = 0
+        try:
+            with open(self.journal_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    # 无法解析或格式不对的记录都视为崩溃时写坏的末尾
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        break
+                    good_offset += len(line)
+                    count += 1
+
+            if good_offset < os.path.getsize(self.journal_path):
+                logging.warning("会话日志末尾不完整，已丢弃")
+                with open(self.journal_path, 'r+b') as f:
+                    f.truncate(good_offset)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"重放会话日志时出错: {str(e)}")
+        return count
+
+    def _open_journal(self):
+        try:
+            os.makedirs(self.session_dir, exist_ok=True)
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        except OSError as e:
+            logging.error(f"打开会话日志时出错: {str(e)}")
+            self._journal = None
+
+    def _apply(self, record):
+        """把一条日志记录应用到内存状态（记录均为赋值操作，可重复应用）
+
+        格式不对的记录抛出ValueError，重放时视为写坏的末尾
+        """
+        if not isinstance(record, dict):
+            raise ValueError(f"日志记录格式不正确: {record!r}")
+
+        op = record.get("op")
+        value = record.get("v")
+        clip = record.get("c")
+        if op == "i" and self._is_int(value) and value >= 0:
+            self.index = value
+        elif op == "v" and isinstance(clip, str):
+            self.clips.setdefault(clip, [False, False])[0] = True
+        elif op == "f" and isinstance(clip, str) and isinstance(value, bool):
+            self.clips.setdefault(clip, [False, False])[1] = value
+        elif op == "p" and isinstance(clip, str) and self._is_int(value):
+            self.clip = clip
+            self.position_ms = value
+        else:
+            raise ValueError(f"日志记录格式不正确: {record!r}")
+
+    def _append(self, record):
+        self._apply(record)
+        if self._journal is None:
+            return
+
+        try:
+            self._journal.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n")
+        except OSError as e:
+            logging.error(f"写入会话日志时出错: {str(e)}")
+            return
+
+        self._journal_records += 1
+        self._pending += 1
+        if self._journal_records >= self.COMPACT_THRESHOLD:
+            self.snapshot()
+        elif self._pending >= self.FSYNC_BATCH:
+            self.sync()
+
+    def set_index(self, index):
+        """记录自动模式下的播放位置"""
+        if index != self.index:
+            self._append({"op": "i", "v": index})
+
+    def mark_viewed(self, clip):
+        """记录片段已看"""
+        if not self.clips.get(clip, [False, False])[0]:
+            self._append({"op": "v", "c": clip})
+
+    def set_flagged(self, clip, flagged):
+        """记录片段标记状态"""
+        if self.is_flagged(clip) != flagged:
+            self._append({"op": "f", "c": clip, "v": flagged})
+
+    def is_flagged(self, clip):
+        return self.clips.get(clip, [False, False])[1]
+
+    def set_position(self, clip, position_ms):
+        """记录当前片段的播放位置"""
+        if clip != self.clip or abs(position_ms - self.position_ms) >= self.POSITION_STEP_MS:
+            self._append({"op": "p", "c": clip, "v": position_ms})
+
+    def sync(self):
+        """把已写入的日志记录落盘"""
+        if self._journal is None or not self._pending:
+            return
+        try:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        except OSError as e:
+            logging.error(f"同步会话日志时出错: {str(e)}")
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def maybe_sync(self):
+        """距上次落盘超过间隔时同步日志"""
+        if self._pending and time.monotonic() - self._last_sync >= self.FSYNC_INTERVAL:
+            self.sync()
+
+    def snapshot(self):
+        """把当前状态写成快照并清空日志"""
+        try:
+            source = self._source_signature()
+        except OSError:
+            source = None
+
+        data = {
+            "source": source,
+            "playlist": self.playlist,
+            "index": self.index,
+            "clips": self.clips,
+            "clip": self.clip,
+            "position_ms": self.position_ms,
+        }
+        tmp_path = self.snapshot_path + ".tmp"
+        try:
+            os.makedirs(self.session_dir, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+
+            # 快照已包含全部状态，日志可以清空
+            if self._journal is not None:
+                self._journal.truncate(0)
+            else:
+                open(self.journal_path, 'w').close()
+        except (OSError, ValueError) as e:
+            logging.error(f"写入会话快照时出错: {str(e)}")
+            return
+        finally:
+            if self._journal is None:
+                self._open_journal()
 
-    # 去重并返回
-    return list(set(ids))
+        self._journal_records = 0
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        """关闭会话，写入最终快照"""
+        self.snapshot()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
 
 
 class VideoApp:
@@ -151,8 +673,27 @@ class VideoApp:
         self.annotations = {}
         self.current_frame = 0
         self.frame_count = 0
-        self.video_files = self.get_video_files()
-        self.current_video_index = 0
+        self.resume_clip = None
+        self.resume_position_ms = 0
+
+        self.annotation_index = AnnotationIndex(JSON_FILE)
+        self.annotation_cache = AnnotationCache(self.annotation_index, ANNOTATION_CACHE_BYTES)
+
+        # 优先从会话快照恢复播放列表和进度，视频目录和标注文件都没有变化时不重新遍历
+        self.session = ReviewSession(SESSION_DIR, VIDEO_DIR, JSON_FILE)
+        if not self.session.restore():
+            self.session.start(self.get_video_files())
+        self.video_files = self.session.playlist
+        self.current_video_index = self.session.index
+
+        # 中断时正在看的片段：回到该片段并跳转到上次的播放位置
+        clip = self.session.clip
+        if clip and 0 < self.current_video_index <= len(self.video_files) \
+                and self.video_files[self.current_video_index - 1] == f"{clip}.mp4":
+            self.current_video_index -= 1
+            self.resume_clip = clip
+            self.resume_position_ms = self.session.position_ms
+
         self.auto_mode = False
         self.current_video_id = None
         self.seeking = False
@@ -215,6 +756,8 @@ class VideoApp:
         self.load_prev_button = tk.Button(button_frame, text="上一个视频", command=self.load_previous_video)
         self.load_prev_button.pack(side="left", padx=5)
         self.load_prev_button.config(state="disabled")
+        self.flag_button = tk.Button(button_frame, text="标记片段", command=self.toggle_flag)
+        self.flag_button.pack(side="left", padx=5)
 
         self.progress = ttk.Scale(control_frame, from_=0, to=100, orient="horizontal",
                                   command=self.on_progress_change)
@@ -306,27 +849,25 @@ class VideoApp:
 
     def get_video_files(self):
         """获取视频文件列表"""
-        annotated_ids = set(get_annotated_video_ids())
+        index = self.annotation_index
         files = []
 
         for f in os.listdir(VIDEO_DIR):
             if f.endswith(".mp4"):
                 video_id = f.replace(".mp4", "")
 
-                if video_id in annotated_ids:
+                if index.contains(video_id):
                     files.append(f)
                     continue
 
                 if '_' in video_id:
                     base_id = video_id.split('_')[0]
-                    if base_id in annotated_ids:
+                    if index.contains(base_id):
                         files.append(f)
                         continue
 
-                for annotated_id in annotated_ids:
-                    if annotated_id.startswith(video_id) or video_id.startswith(annotated_id):
-                        files.append(f)
-                        break
+                if index.has_prefix_match(video_id):
+                    files.append(f)
 
         logging.info(f"找到 {len(files)} 个标注视频文件")
         return sorted(files)
@@ -341,6 +882,7 @@ class VideoApp:
             video_id = self.video_files[self.current_video_index].replace(".mp4", "")
             logging.info(f"自动加载视频 {video_id}")
             self.current_video_index += 1
+            self.session.set_index(self.current_video_index)
         else:
             video_id = self.id_entry.get().strip()
             if not video_id:
@@ -389,6 +931,8 @@ class VideoApp:
                 self.media_player.set_xwindow(self.canvas.winfo_id())
 
             self.current_video_id = video_id
+            self.session.mark_viewed(video_id)
+            self.update_flag_button()
 
             self.media_player.play()
 
@@ -413,15 +957,42 @@ class VideoApp:
 
                 self.play()
 
+                if self.resume_clip == self.current_video_id and self.resume_position_ms > 0:
+                    self.media_player.set_time(int(self.resume_position_ms))
+                    logging.info(f"从上次位置继续播放: {self.resume_position_ms / 1000.0:.2f}秒")
+                self.resume_clip = None
+                self.resume_position_ms = 0
+
             else:
                 self.root.after(200, self.on_video_loaded)
 
         except Exception as e:
             logging.error(f"视频加载回调时发生错误：{str(e)}")
 
+    def toggle_flag(self):
+        """标记/取消标记当前片段"""
+        if not self.current_video_id:
+            return
+
+        flagged = not self.session.is_flagged(self.current_video_id)
+        self.session.set_flagged(self.current_video_id, flagged)
+        self.update_flag_button()
+        logging.info(f"{'标记' if flagged else '取消标记'}片段 {self.current_video_id}")
+
+    def update_flag_button(self):
+        """根据当前片段的标记状态更新按钮文字"""
+        if self.current_video_id and self.session.is_flagged(self.current_video_id):
+            self.flag_button.config(text="取消标记")
+        else:
+            self.flag_button.config(text="标记片段")
+
     def load_annotations(self, video_id):
         """加载标注信息"""
-        self.annotations = load_annotations_from_json(video_id)
+        self.annotations = self.annotation_cache.get(video_id)
+        cache = self.annotation_cache
+        logging.info(f"标注缓存命中率: {cache.hit_rate:.1%} "
+                     f"({cache.hits}/{cache.hits + cache.misses})，"
+                     f"占用 {cache.used_bytes / 1024:.0f}KB / {cache.budget_bytes / 1024:.0f}KB")
         self.display_annotations()
 
     def display_annotations(self):
@@ -595,9 +1166,14 @@ class VideoApp:
                         duration_str = self.format_time(duration)
                         self.time_label.config(text=f"{current_str} / {duration_str}")
 
+                        if self.current_video_id and self.is_playing:
+                            self.session.set_position(self.current_video_id, self.media_player.get_time())
+
             except Exception as e:
                 logging.error(f"更新进度条时出错: {str(e)}")
 
+        self.session.maybe_sync()
+
         self.root.after(100, self.update_progress)
 
     def format_time(self, seconds):
@@ -641,6 +1217,12 @@ class VideoApp:
 
     def on_closing(self):
         """窗口关闭时的清理工作"""
+        try:
+            self.session.close()
+            logging.info("审阅会话已保存")
+        except Exception as e:
+            logging.error(f"保存审阅会话时发生错误：{str(e)}")
+
         try:
             if self.media_player is not None:
                 self.media_player.stop()